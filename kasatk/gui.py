@@ -1,94 +1,244 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import concurrent
+import functools
 import logging
+import math
 import os
-import signal
 import sys
-import threading
+import time
 import tkinter
 import tkinter.font
 import tkinter.messagebox
 import tkinter.ttk
+import typing
 
-try:
-    from typing import TypedDict
-except ImportError:
-    from typing_extensions import TypedDict
-
-import kasa
+if typing.TYPE_CHECKING:
+    # kasa is imported where it is needed instead, since importing it is slow
+    # and would delay the GUI from showing up
+    import kasa
 
 logger = logging.getLogger(__name__)
 
 
-def apoptosis():
-    """Tell the operating system to kill us. This is useful in case we cannot
-    die. For example, a child thread might refuse to die.
+@functools.lru_cache(maxsize=None)
+def resource_path(relative_path):
+    """Find a resource in a PyInstaller executable, or in the local directory.
+    A missing resource is left for the caller to report when opening it.
     """
-    import os
+    if hasattr(sys, "_MEIPASS"):
+        logger.info("Finding resource inside PyInstaller executable")
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
+
+
+async def update_bulb(bulb, hue, saturation, brightness):
+    # note: all arguments need to ints
+    assert isinstance(hue, int)
+    assert isinstance(saturation, int)
+    assert isinstance(brightness, int)
 
-    # Windows option
-    if os.name == "nt":
-        import subprocess
+    # set_hsv sets the brightness too, so this is a single request
+    await bulb.set_hsv(hue, saturation, brightness)
 
-        subprocess.run(["taskkill", "/IM", str(os.getpid()), "/F"])
-    # *Nix option
+
+def _future_error_handler_callback(widget, future):
+    """
+    Show error messages using tkinter windows to indicate failures
+    """
+    # The future is already done, so inspect it directly instead of raising
+    # and catching its exception.
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is None:
+        return
+    if isinstance(exc, asyncio.TimeoutError):
+        message = "Operation timed out."
+    elif isinstance(exc, Exception):
+        message = "Something went wrong."
     else:
-        os.kill(os.getpid(), signal.SIGKILL)
+        return
+    # We are inside an asyncio loop pass here. Show the dialog (and run its
+    # nested Tk event loop) once the pass is over, otherwise the asyncio loop
+    # cannot run until the dialog is dismissed.
+    widget.after_idle(
+        functools.partial(
+            tkinter.messagebox.showwarning, title="Whoops.", message=message
+        )
+    )
 
 
-def resource_path(relative_path):
-    """Find a resource in a PyInstaller executable, or in the local directory"""
-    if hasattr(sys, "_MEIPASS"):
-        logger.info("Finding resource inside PyInstaller executable")
-        p = os.path.join(sys._MEIPASS, relative_path)
-        assert os.path.exists(p)
-        return p
-    return os.path.join(os.path.abspath("."), relative_path)
+def _schedule_callback(widget, coroutine_function, event=None):
+    """Run an asynchronous callback of widget on the event loop, showing an
+    error message if it fails. Use functools.partial to bind it to a widget
+    event.
+    """
+    future = asyncio.ensure_future(coroutine_function())
+    # Originally, I was waiting on future.result here, but blocking on the
+    # result seems to cause issues with the kasa library, so we'll settle for a
+    # callback instead.
+    future.add_done_callback(functools.partial(_future_error_handler_callback, widget))
+    return future
 
 
-class LightState(TypedDict):
-    on_off: int
-    mode: str
-    hue: int
-    saturation: int
-    color_temp: int
-    brightness: int
+class TkEventLoop(asyncio.SelectorEventLoop):
+    """An asyncio event loop that is driven from the Tk mainloop
 
+    The sockets watched by the loop are also registered with Tk as file
+    handlers, so Tk wakes us up as soon as a socket is ready (eg. when a
+    discovery reply arrives) rather than on the next poll. Otherwise, the
+    next pass is scheduled for when the earliest asyncio timer is due.
 
-async def update_bulb(bulb, brightness=None, hue=None, saturation=None):
-    # note: all arguments need to ints
-    assert brightness is None or isinstance(brightness, int)
-    assert hue is None or isinstance(hue, int)
-    assert saturation is None or isinstance(saturation, int)
-
-    state: LightState = await bulb.get_light_state()
-    await bulb.set_hsv(
-        hue if hue is not None else state["hue"],
-        saturation if saturation is not None else state["saturation"],
-        brightness if brightness is not None else state["brightness"],
-    )
+    ... note:: Tk only supports file handlers on Unix. On other platforms,
+    sockets are checked every SOCKET_POLL_INTERVAL_MS while any are watched.
+    """
+
+    # Longest time to sleep between passes when no asyncio timer is due
+    POLL_INTERVAL_MS = 50
+    # Same, but while sockets are watched and Tk cannot tell us about them
+    SOCKET_POLL_INTERVAL_MS = 5
+
+    def __init__(self, widget):
+        # The parent initializer already registers the self-pipe reader, so
+        # these must exist before calling it.
+        self._widget = widget
+        self._tk_file_handlers = hasattr(widget.tk, "createfilehandler")
+        self._tk_masks = {}
+        self._after_id = None
+        self._idle_pending = False
+        super().__init__()
+        self._schedule_run(self.POLL_INTERVAL_MS)
+
+    def call_soon(self, callback, *args, **kwargs):
+        handle = super().call_soon(callback, *args, **kwargs)
+        # Something outside of the loop (eg. a widget callback creating a
+        # task) has work for us, so don't wait for the next timer.
+        if not self.is_running() and not self._idle_pending:
+            self._schedule_run()
+        return handle
+
+    def run_pending(self):
+        """Run the callbacks that are ready without blocking, then schedule
+        the next pass
+        """
+        # A nested Tk event loop started from a callback can call us while the
+        # loop is already running. The outer pass schedules the next one when
+        # it is done, so don't reschedule here: an idle pass would just keep
+        # coming back to this point without draining anything.
+        if self.is_running():
+            return
+
+        super().call_soon(self.stop)
+        self.run_forever()
+
+        if self._ready:
+            # Callbacks scheduled while we were running (eg. a task waking up
+            # because its socket became readable) should run right away.
+            self._schedule_run()
+        elif self._scheduled:
+            delay = self._scheduled[0].when() - self.time()
+            self._schedule_run(
+                min(max(1, math.ceil(delay * 1000)), self._poll_interval())
+            )
+        else:
+            self._schedule_run(self._poll_interval())
+
+    def _poll_interval(self):
+        """How long (in milliseconds) the next pass may wait for sockets"""
+        # Without Tk file handlers, nothing wakes us up when a socket becomes
+        # ready, so poll quickly while there is more to watch than the
+        # self-pipe.
+        if not self._tk_file_handlers and len(self._selector.get_map()) > 1:
+            return self.SOCKET_POLL_INTERVAL_MS
+        return self.POLL_INTERVAL_MS
+
+    def _schedule_run(self, delay_ms=None):
+        """(Re)schedule the next pass, or run it once Tk is idle if no delay
+        is given
+        """
+        if self._after_id is not None:
+            self._widget.after_cancel(self._after_id)
+        if delay_ms is None:
+            self._after_id = self._widget.after_idle(self.run_pending)
+        else:
+            self._after_id = self._widget.after(delay_ms, self.run_pending)
+        self._idle_pending = delay_ms is None
+
+    def _tk_watch(self, fd, add=0, remove=0):
+        """Update the Tk file handler mask for a file descriptor"""
+        if not self._tk_file_handlers:
+            return
+        tk = self._widget.tk
+        if not isinstance(fd, int):
+            fd = fd.fileno()
+        old_mask = self._tk_masks.get(fd, 0)
+        new_mask = (old_mask | add) & ~remove
+        if new_mask == old_mask:
+            return
+        # Tk keeps a single handler per file, so replace it wholesale
+        if old_mask:
+            tk.deletefilehandler(fd)
+        if new_mask:
+            tk.createfilehandler(fd, new_mask, self._on_tk_file_event)
+            self._tk_masks[fd] = new_mask
+        else:
+            del self._tk_masks[fd]
+
+    def _on_tk_file_event(self, fd, mask):
+        self.run_pending()
 
+    def _add_reader(self, fd, callback, *args):
+        handle = super()._add_reader(fd, callback, *args)
+        self._tk_watch(fd, add=tkinter.READABLE)
+        return handle
 
-def _future_error_handler_callback(future):
+    def _remove_reader(self, fd):
+        self._tk_watch(fd, remove=tkinter.READABLE)
+        return super()._remove_reader(fd)
+
+    def _add_writer(self, fd, callback, *args):
+        handle = super()._add_writer(fd, callback, *args)
+        self._tk_watch(fd, add=tkinter.WRITABLE)
+        return handle
+
+    def _remove_writer(self, fd):
+        self._tk_watch(fd, remove=tkinter.WRITABLE)
+        return super()._remove_writer(fd)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_style():
+    """The ttk.Style shared by every widget. The Tk root must exist first.
+
+    :rtype: tkinter.ttk.Style
     """
-    Show error messages using tkinter windows to indicate failures
+    return tkinter.ttk.Style()
+
+
+@functools.lru_cache(maxsize=None)
+def _style_lookup(style_name, option):
+    """Cached version of ttk.Style.lookup()"""
+    return _get_style().lookup(style_name, option)
+
+
+def _clear_style_caches(event=None):
+    """Forget the cached style lookups, eg. after the theme changes, and bring
+    the device name style up to date if it is already in use
     """
-    try:
-        # Setting the timeout to zero, though it should not matter since the
-        # future should already be completed.
-        future.result(timeout=0)
-    except concurrent.futures.TimeoutError:
-        tkinter.messagebox.showwarning(title="Whoops.", message="Operation timed out.")
-    except Exception:
-        tkinter.messagebox.showwarning(title="Whoops.", message="Something went wrong.")
+    _style_lookup.cache_clear()
+    _big_label_style.cache_clear()
+    if _big_font.cache_info().currsize:
+        # The labels on screen keep using the same font, so update it in
+        # place, and configure the style for the new theme right away.
+        _match_big_font(_big_font())
+        _big_label_style()
 
 
 class ScrollableFrame(tkinter.ttk.Frame):
     def __init__(self, container, *args, **kwargs):
         super().__init__(container, *args, **kwargs)
-        background = tkinter.ttk.Style().lookup("TFrame", "background")
+        background = _style_lookup("TFrame", "background")
         self.canvas = tkinter.Canvas(
             self, background=background, bd=0, highlightthickness=0
         )
@@ -110,9 +260,17 @@ class ScrollableFrame(tkinter.ttk.Frame):
         # update the inner content frame when the canvas resizes
         self.canvas.bind("<Configure>", self._resize_canvas_frame)
 
-        # bind mouse scroll only when the mouse is over our element
-        self.canvas.bind("<Enter>", self._bind_mouse)
-        self.canvas.bind("<Leave>", self._unbind_mouse)
+        # Mouse wheel events are delivered to the widget under the pointer (or
+        # to the focused widget, on Windows), which is usually one of our
+        # children rather than the canvas. Bind once on the toplevel, which is
+        # in the bindtags of every widget, and check the pointer position when
+        # the event arrives.
+        toplevel = self.winfo_toplevel()
+        if sys.platform == "linux":
+            toplevel.bind("<Button-4>", self._on_mouse_scroll_linux, add="+")
+            toplevel.bind("<Button-5>", self._on_mouse_scroll_linux, add="+")
+        else:
+            toplevel.bind("<MouseWheel>", self._on_mouse_scroll_other, add="+")
 
     def _resize_canvas_frame(self, event):
         """Resize the width of the inner content frame"""
@@ -121,147 +279,223 @@ class ScrollableFrame(tkinter.ttk.Frame):
         # can scroll it.
         self.canvas.itemconfig(self.canvas_frame_id, width=event.width)
 
-    def _bind_mouse(self, event):
-        if sys.platform == "linux":
-            self.canvas.bind_all("<Button-4>", self._on_mouse_scroll)
-            self.canvas.bind_all("<Button-5>", self._on_mouse_scroll)
-        else:
-            self.canvas.bind_all("<MouseWheel>", self._on_mouse_scroll)
-
-    def _unbind_mouse(self, event):
-        self.canvas.unbind_all("<Button-4>")
-        self.canvas.unbind_all("<Button-5>")
-        self.canvas.unbind_all("<MouseWheel>")
+    def _is_under_pointer(self, event):
+        """Whether the pointer is over the canvas or one of its descendants"""
+        # Ask Tcl for the path name directly, since winfo_containing() fails on
+        # widgets that were not created from Python.
+        widget_path = str(
+            self.tk.call("winfo", "containing", event.x_root, event.y_root)
+        )
+        canvas_path = str(self.canvas)
+        return widget_path == canvas_path or widget_path.startswith(canvas_path + ".")
 
-    def _on_mouse_scroll(self, event):
-        logger.info("ScrollableFrame._on_mousewheel()")
+    def _on_mouse_scroll_linux(self, event):
+        if not self._is_under_pointer(event):
+            return
+        logger.info("ScrollableFrame._on_mouse_scroll_linux()")
 
         # Button 5 is "scroll up" in Linux. It seems that event.delta may just
         # be zero on Linux.
-        if sys.platform == "linux" and event.num == 5:
+        if event.num == 5:
             self.canvas.yview_scroll(1, "units")
         # Button 4 is "scroll down" in Linux. It seems that event.delta may
         # just be zero on Linux.
-        elif sys.platform == "linux" and event.num == 4:
+        elif event.num == 4:
             self.canvas.yview_scroll(-1, "units")
 
-        if sys.platform != "linux" and event.delta != 0:
-            self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+    def _on_mouse_scroll_other(self, event):
+        if not self._is_under_pointer(event):
+            return
+        logger.info("ScrollableFrame._on_mouse_scroll_other()")
+
+        if event.delta != 0:
+            # one unit per 120 delta, truncated towards zero
+            units = abs(event.delta) // 120
+            self.canvas.yview_scroll(-units if event.delta > 0 else units, "units")
+
+
+@functools.lru_cache(maxsize=1)
+def _big_label_style():
+    """Configure the label style used for device names. This needs the Tk root
+    to exist, so it is done lazily, but only once.
+
+    :returns: the name of the style
+    """
+    big_label_style_name = "my.TLabel"
+    big_font = _big_font()
+    style = _get_style()
+    # Configuring a style makes ttk send <<ThemeChanged>> again, so only do it
+    # when the current theme does not have our font yet.
+    if style.lookup(big_label_style_name, "font") != str(big_font):
+        style.configure(big_label_style_name, font=big_font)
+    return big_label_style_name
+
+
+@functools.lru_cache(maxsize=1)
+def _big_font():
+    """The default label font, but bigger
+
+    ... note:: Tk deletes the font once the Font object gets garbage
+    collected, so the reference held by lru_cache matters. The cache is never
+    cleared; _match_big_font() updates the font instead.
+    """
+    big_font = tkinter.font.Font()
+    _match_big_font(big_font)
+    return big_font
+
+
+def _match_big_font(big_font):
+    """Make big_font a bigger copy of the current theme's label font"""
+    default_font_name = _style_lookup("TLabel", "font")
+    default_font = tkinter.font.nametofont(default_font_name)
+    options = {**default_font.actual(), "size": 12}
+    if big_font.actual() != options:
+        big_font.configure(**options)
+
+
+# 16x16 pencil bitmap for EditableText.pencil_icon
+_PENCIL_XBM = (
+    b"#define image_width 16\n"
+    b"#define image_height 16\n"
+    b"static char image_bits[] = {\n"
+    b"0x00,0x1c,0x00,0x3e,0x00,0x7f,0x80,0xf7,0xc0,0xf3,0xe0,0x79,0xf0,0x3c,0x78,\n"
+    b"0x1e,0x3c,0x0f,0x9c,0x07,0xcc,0x03,0xfc,0x01,0xfc,0x00,0x7c,0x00,0xff,0xff,\n"
+    b"0xff,0xff\n"
+    b"};"
+)
 
 
 class EditableText(tkinter.ttk.Frame):
+    # pencil icons keyed by (foreground, background), see pencil_icon
+    _pencil_icons = {}
+
     def __init__(self, container, initial_text_value, callback):
         super(self.__class__, self).__init__(container)
 
         self.callback = callback
 
         self.text = tkinter.StringVar(value=initial_text_value)
-        self.child_widgets = []
+
+        # Both modes are created up front and then packed or forgotten, which
+        # is cheaper than destroying and recreating them on every toggle.
+        self.text_label = tkinter.ttk.Label(
+            self, textvariable=self.text, style=_big_label_style()
+        )
+        self.edit_label = tkinter.ttk.Label(self, image=self.pencil_icon)
+        self.edit_label.bind("<ButtonRelease-1>", self._edit_mode_start)
+
+        self.text_entry = tkinter.ttk.Entry(self, textvariable=self.text)
+        self.text_entry.bind("<Return>", self._edit_mode_finish)
+
         self._render_static_mode()
 
     def _edit_mode_start(self, event=None):
-        for widget in self.child_widgets:
-            widget.destroy()
+        self.text_label.pack_forget()
+        self.edit_label.pack_forget()
         self._render_edit_mode()
 
     def _edit_mode_finish(self, event=None):
         self.callback(self.text.get())
-        for widget in self.child_widgets:
-            widget.destroy()
+        self.text_entry.pack_forget()
         self._render_static_mode()
 
     def _render_static_mode(self):
-        """render non-editable text"""
-        big_label_style_name = "my.TLabel"
-        style = tkinter.ttk.Style()
-        default_font_name = style.lookup("TLabel", "font")
-        default_font = tkinter.font.nametofont(default_font_name)
-        custom_font = {**default_font.actual(), "size": 12}
-        style.configure(big_label_style_name, font=custom_font)
-
-        text_label = tkinter.ttk.Label(
-            self, text=self.text.get(), style=big_label_style_name
-        )
-        text_label.pack(side=tkinter.LEFT)
-
-        edit_label = tkinter.ttk.Label(self, image=self.pencil_icon)
-        edit_label.bind("<ButtonRelease-1>", self._edit_mode_start)
-        edit_label.pack(side=tkinter.LEFT)
-
-        self.child_widgets.append(text_label)
-        self.child_widgets.append(edit_label)
+        """show non-editable text"""
+        self.text_label.pack(side=tkinter.LEFT)
+        self.edit_label.pack(side=tkinter.LEFT)
 
     def _render_edit_mode(self):
-        text_entry = tkinter.ttk.Entry(self, textvariable=self.text)
-        text_entry.pack(side=tkinter.LEFT)
-        text_entry.bind("<Return>", self._edit_mode_finish)
-
-        self.child_widgets.append(text_entry)
+        self.text_entry.pack(side=tkinter.LEFT)
+        self.text_entry.focus_set()
 
     @property
     def pencil_icon(self):
-        """... note:: Make sure to store a reference to the result, as the
-        BitmapImage may otherwise get garbage collected. Passing it to
-        tkinter.Label is not sufficient.
-        (https://stackoverflow.com/a/31959529/2796349)
-        """
-        style = tkinter.ttk.Style()
-        foreground = style.lookup("TFrame", "foreground")
-        background = style.lookup("TFrame", "background")
+        """The pencil icon for the current theme colors, shared by every
+        EditableText
 
-        if not hasattr(self, "_pencil_icon"):
-            self._pencil_icon = tkinter.BitmapImage(
-                data=b"#define image_width 16\n#define image_height 16\nstatic char image_bits[] = {\n0x00,0x1c,0x00,0x3e,0x00,0x7f,0x80,0xf7,0xc0,0xf3,0xe0,0x79,0xf0,0x3c,0x78,\n0x1e,0x3c,0x0f,0x9c,0x07,0xcc,0x03,0xfc,0x01,0xfc,0x00,0x7c,0x00,0xff,0xff,\n0xff,0xff\n};",
+        ... note:: The icons are stored in a class attribute, as a BitmapImage
+        may otherwise get garbage collected. Passing it to tkinter.Label is
+        not sufficient. (https://stackoverflow.com/a/31959529/2796349)
+        """
+        colors = (
+            _style_lookup("TFrame", "foreground"),
+            _style_lookup("TFrame", "background"),
+        )
+        icon = self._pencil_icons.get(colors)
+        if icon is None:
+            foreground, background = colors
+            icon = self._pencil_icons[colors] = tkinter.BitmapImage(
+                data=_PENCIL_XBM,
                 background=background,
                 foreground=foreground,
             )
-        return self._pencil_icon
+        return icon
 
 
-class PlugFrame(tkinter.ttk.Frame):
+class DeviceFrame(tkinter.ttk.Frame):
+    """Base class for the frames of a single kasa device, with a power button
+    that toggles self.device
+    """
+
+    # How long (in seconds) to trust the cached power state
+    STATE_TTL = 2.0
+
+    def _set_device(self, device: "kasa.SmartDevice"):
+        self.device = device
+        # cached power state, see _power_callback()
+        self._is_on = self.device.is_on
+        self._last_update = time.monotonic()
+
     async def _power_callback(self):
         self.power_button.state(["disabled"])
 
         try:
-            await (self.plug.turn_off() if self.plug.is_on else self.plug.turn_on())
-            await self.plug.update()
+            # Only ask the device for its state if our copy may be out of date
+            if time.monotonic() - self._last_update > self.STATE_TTL:
+                await self.device.update()
+                self._is_on = self.device.is_on
+            await (self.device.turn_off() if self._is_on else self.device.turn_on())
+            self._is_on = not self._is_on
+            self._last_update = time.monotonic()
         finally:
-            self.power_button.state(
-                [
-                    "!disabled",
-                    "pressed" if self.plug.is_on else "!pressed",
-                ]
-            )
-            self.power_button["text"] = "Turn Off" if self.plug.is_on else "Turn On"
+            self.power_button.state(["!disabled"])
+            self._show_power_state()
 
+    def _show_power_state(self):
+        on = self._is_on
+        self.power_button.state(["pressed" if on else "!pressed"])
+        self.power_button["text"] = "Turn Off" if on else "Turn On"
+
+    def refresh(self, device: "kasa.SmartDevice"):
+        """Show the state of a freshly discovered device, without rebuilding
+        the frame
+        """
+        self._set_device(device)
+        self._show_power_state()
+
+
+class PlugFrame(DeviceFrame):
     @classmethod
-    def for_plug(cls, loop, plug: kasa.SmartPlug, config, *args, **kwargs):
+    def for_plug(cls, plug: "kasa.SmartPlug", config, *args, **kwargs):
         """Create a new plug frame given a SmartPlug
 
         ... note:: I think using a classmethod here is a better approach than
         breaking the initializer interface of the parent Frame class.
         """
         self = cls(*args, **kwargs)
-        self.plug = plug
+        self._set_device(plug)
 
-        plug_name = getattr(self.plug, "alias", None) or self.plug.mac
+        plug_name = getattr(self.device, "alias", None) or self.device.mac
 
         # TODO See if we can update the device alias instead of just logging it
         # here
-        EditableText(
-            self, plug_name, lambda new_device_name: logger.info(new_device_name)
-        ).grid(column=0, row=0, columnspan=4)
+        EditableText(self, plug_name, logger.info).grid(column=0, row=0, columnspan=4)
 
-        self.power_button = tkinter.ttk.Button(
-            self,
-            text="Turn Off" if self.plug.is_on else "Turn On",
-        )
-        self.power_button.state(["pressed" if self.plug.is_on else "!pressed"])
+        self.power_button = tkinter.ttk.Button(self)
+        self._show_power_state()
         self.power_button.bind(
             "<ButtonRelease-1>",
-            lambda event, self=self, loop=loop: asyncio.run_coroutine_threadsafe(
-                self._power_callback(), loop
-            ),
+            functools.partial(_schedule_callback, self, self._power_callback),
         )
 
         self.power_button.grid(column=0, row=2, columnspan=4, sticky="ns")
@@ -269,62 +503,61 @@ class PlugFrame(tkinter.ttk.Frame):
         return self
 
 
-class BulbFrame(tkinter.ttk.Frame):
-    async def _hue_callback(self):
-        return await update_bulb(self.bulb, hue=int(self.hue_slider.get()))
-
-    async def _saturation_callback(self):
-        return await update_bulb(
-            self.bulb, saturation=int(self.saturation_slider.get())
-        )
+class BulbFrame(DeviceFrame):
+    # How long to wait for further slider changes before sending them to the
+    # bulb, so that a burst of releases results in a single request
+    UPDATE_DELAY_MS = 100
 
-    async def _brightness_callback(self):
-        return await update_bulb(
-            self.bulb, brightness=int(self.brightness_slider.get())
+    async def _hsv_callback(self):
+        hsv = (
+            int(self.hue_slider.get()),
+            int(self.saturation_slider.get()),
+            int(self.brightness_slider.get()),
         )
-
-    async def _power_callback(self):
-        self.power_button.state(["disabled"])
-
-        try:
-            await (self.bulb.turn_off() if self.bulb.is_on else self.bulb.turn_on())
-            await self.bulb.update()
-        finally:
-            self.power_button.state(
-                [
-                    "!disabled",
-                    "pressed" if self.bulb.is_on else "!pressed",
-                ]
-            )
-            self.power_button["text"] = "Turn Off" if self.bulb.is_on else "Turn On"
+        # One write at a time, so that they reach the bulb in order
+        async with self._hsv_lock:
+            if hsv == self._hsv_cache:
+                return
+            await update_bulb(self.device, *hsv)
+            self._hsv_cache = hsv
+            # Setting the light state also turns the bulb on
+            self._is_on = True
+            self._last_update = time.monotonic()
+            self._show_power_state()
+
+    def _schedule_update(self, event=None):
+        """Send the slider values to the bulb once they settle"""
+        if self._pending_update is not None:
+            self.after_cancel(self._pending_update)
+        self._pending_update = self.after(self.UPDATE_DELAY_MS, self._fire_update)
+
+    def _fire_update(self):
+        self._pending_update = None
+        _schedule_callback(self, self._hsv_callback)
+
+    def refresh(self, bulb: "kasa.SmartBulb"):
+        super().refresh(bulb)
+        hue, saturation, brightness = self.device.hsv
+        self.hue_slider.set(hue)
+        self.saturation_slider.set(saturation)
+        self.brightness_slider.set(brightness)
+        self._hsv_cache = (hue, saturation, brightness)
 
     @classmethod
-    def for_bulb(cls, loop, bulb: kasa.SmartBulb, config, *args, **kwargs):
+    def for_bulb(cls, bulb: "kasa.SmartBulb", config, *args, **kwargs):
         """Create a new bulb frame given a SmartBulb
 
         ... note:: I think using a classmethod here is a better approach than
         breaking the initializer interface of the parent Frame class.
         """
         self = cls(*args, **kwargs)
-        self.bulb = bulb
+        self._set_device(bulb)
+        hue, saturation, brightness = self.device.hsv
 
-        def wrap_callback(f):
-            """
-            Wrap asynchronous callback as a synchronous callback and handle
-            errors
-            """
-            nonlocal loop
-
-            def _wrapped(_event):
-                nonlocal f, loop
-
-                future = asyncio.run_coroutine_threadsafe(f(), loop)
-                # Originally, I was waiting on future.result here, but blocking
-                # on the result seems to cause issues with the kasa library, so
-                # we'll settle for a callback instead.
-                future.add_done_callback(_future_error_handler_callback)
-
-            return _wrapped
+        self._pending_update = None
+        # the last HSV values sent to (or read from) the bulb
+        self._hsv_cache = (hue, saturation, brightness)
+        self._hsv_lock = asyncio.Lock()
 
         self.hue_label = tkinter.ttk.Label(self, text="hue")
         self.saturation_label = tkinter.ttk.Label(self, text="saturation")
@@ -333,43 +566,32 @@ class BulbFrame(tkinter.ttk.Frame):
         self.hue_slider = tkinter.ttk.Scale(
             self, from_=0, to=360, orient=tkinter.HORIZONTAL
         )
-        self.hue_slider.bind("<ButtonRelease-1>", wrap_callback(self._hue_callback))
-        self.hue_slider.set(self.bulb.hsv[0])
+        self.hue_slider.bind("<ButtonRelease-1>", self._schedule_update)
+        self.hue_slider.set(hue)
 
         self.saturation_slider = tkinter.ttk.Scale(
             self, from_=0, to=100, orient=tkinter.HORIZONTAL
         )
-        self.saturation_slider.bind(
-            "<ButtonRelease-1>", wrap_callback(self._saturation_callback)
-        )
-        self.saturation_slider.set(self.bulb.hsv[1])
+        self.saturation_slider.bind("<ButtonRelease-1>", self._schedule_update)
+        self.saturation_slider.set(saturation)
 
         self.brightness_slider = tkinter.ttk.Scale(
             self, from_=0, to=100, orient=tkinter.HORIZONTAL
         )
-        self.brightness_slider.bind(
-            "<ButtonRelease-1>", wrap_callback(self._brightness_callback)
-        )
-        self.brightness_slider.set(self.bulb.brightness)
+        self.brightness_slider.bind("<ButtonRelease-1>", self._schedule_update)
+        self.brightness_slider.set(brightness)
 
-        bulb_name = getattr(self.bulb, "alias", None) or self.bulb.mac
+        bulb_name = getattr(self.device, "alias", None) or self.device.mac
 
         # TODO See if we can update the device alias instead of just logging it
         # here
-        EditableText(
-            self, bulb_name, lambda new_device_name: logger.info(new_device_name)
-        ).grid(column=0, row=0, columnspan=4)
+        EditableText(self, bulb_name, logger.info).grid(column=0, row=0, columnspan=4)
 
-        self.power_button = tkinter.ttk.Button(
-            self,
-            text="Turn Off" if self.bulb.is_on else "Turn On",
-        )
-        self.power_button.state(["pressed" if self.bulb.is_on else "!pressed"])
+        self.power_button = tkinter.ttk.Button(self)
+        self._show_power_state()
         self.power_button.bind(
             "<ButtonRelease-1>",
-            lambda event, self=self, loop=loop: asyncio.run_coroutine_threadsafe(
-                self._power_callback(), loop
-            ),
+            functools.partial(_schedule_callback, self, self._power_callback),
         )
 
         self.power_button.grid(column=0, row=2, sticky="ns")
@@ -387,114 +609,133 @@ class BulbFrame(tkinter.ttk.Frame):
 
 
 class KasaDevices(tkinter.Frame):
+    # How many devices to update at once while refreshing
+    MAX_CONCURRENT_UPDATES = 8
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
 
-        # create an asyncio event loop running in a secondary thread
+        # create an asyncio event loop that is driven from the Tk mainloop, so
+        # that every coroutine runs on the same thread as the widgets it
+        # touches
         def exception_handler(loop, context):
-            loop.call_soon_threadsafe(
-                logger.error, "Caught exception {}".format(context)
-            )
+            logger.error("Caught exception {}".format(context))
 
-        self.event_loop = asyncio.new_event_loop()
+        self.event_loop = TkEventLoop(self)
         self.event_loop.set_exception_handler(exception_handler)
-        self.event_thread = threading.Thread(target=self.event_loop.run_forever)
-        self.event_thread.start()
+        asyncio.set_event_loop(self.event_loop)
 
-        self.device_lock = asyncio.Lock()
-        # list of kasa devices
-        self.kasa_devices = []
+        # mac addresses of the devices we are showing, for quick duplicate checks
+        self._known_macs = set()
         # mapping from mac address to widget
         self.device_widgets = {}
-
-        async def process_devices():
-            # queue to process discovered devices
-            #
-            # this must be called from within the loop:
-            #   https://stackoverflow.com/a/53724990/2796349
-            self.device_queue = asyncio.Queue()
-
-            while True:
-                new_item = await self.device_queue.get()
-                logging.info("Discovered device: {}".format(repr(new_item)))
-                try:
-                    await self.add_device(new_item)
-                except Exception as exc:
-                    logging.error(exc)
-
-        self.event_loop.create_task(process_devices())
-
-        # TODO make sure that self.device_queue exists before exiting this function
+        # devices that are still waiting for update_widgets() to run
+        self._new_devices = []
+        self._update_widgets_id = None
 
         self.refresh_button = tkinter.ttk.Button(
             self, text="Refresh", command=self.start_refresh
         )
         self.refresh_button.pack(fill=tkinter.X)
 
-    async def update_widgets(self):
-        for device in self.kasa_devices:
-            # Skip devices that have already been added
-            if device.mac in self.device_widgets:
-                continue
+    def _add_widget(self, device):
+        """Create and pack the widget for a newly added device"""
+        import kasa
 
-            if device.device_type == kasa.DeviceType.Bulb:
-                w = BulbFrame.for_bulb(
-                    self.event_loop, device, self.config, master=self
-                )
-            elif device.device_type == kasa.DeviceType.Plug:
-                w = PlugFrame.for_plug(
-                    self.event_loop, device, self.config, master=self
-                )
-            else:
-                continue
+        if device.device_type == kasa.DeviceType.Bulb:
+            w = BulbFrame.for_bulb(device, self.config, master=self)
+        elif device.device_type == kasa.DeviceType.Plug:
+            w = PlugFrame.for_plug(device, self.config, master=self)
+        else:
+            return
 
-            w.pack(fill=tkinter.X, expand=True)
-            self.device_widgets[device.mac] = w
+        w.pack(fill=tkinter.X, expand=True)
+        self.device_widgets[device.mac] = w
 
     async def add_device(self, device):
         await device.update()
         logger.info("add_device(device={})".format(repr(device)))
-        async with self.device_lock:
-            mac_addrs = [d.mac for d in self.kasa_devices]
-            device_exists = mac_addrs.count(device.mac) > 0
-            if device_exists:
-                return
-            self.kasa_devices.append(device)
-        await self.update_widgets()
+        if device.mac in self._known_macs:
+            # we are already showing this device, so just update its widget
+            widget = self.device_widgets.get(device.mac)
+            if widget is not None:
+                widget.refresh(device)
+            return
+        self._known_macs.add(device.mac)
+
+        # Devices tend to show up in bursts, so create their widgets together
+        # once Tk is idle instead of one at a time.
+        self._new_devices.append(device)
+        if self._update_widgets_id is None:
+            self._update_widgets_id = self.after_idle(self.update_widgets)
+
+    def update_widgets(self):
+        """Create the widgets for the devices added since the last call"""
+        self._update_widgets_id = None
+        devices, self._new_devices = self._new_devices, []
+        for device in devices:
+            # one bad device should not keep the others from showing up
+            try:
+                self._add_widget(device)
+            except Exception as e:
+                logger.error(
+                    "Failed to create a widget for {}: {}".format(repr(device), e)
+                )
 
     async def _do_refresh(self):
         logger.info("KasaDevices._do_refresh() called")
+        import kasa
+
         self.refresh_button.state(["disabled"])
         self.refresh_button["text"] = "Refreshing..."
-        await self.clear_devices()
-        await kasa.Discover.discover(on_discovered=self.device_queue.put)
+
+        # Add each device as soon as it is discovered, so that their updates
+        # run concurrently (up to a limit, so that a busy network does not
+        # open a connection to every device at once), then wait for all of
+        # them to finish. Devices that we already know about keep their
+        # widgets.
+        additions = []
+        seen_macs = set()
+        update_slots = asyncio.Semaphore(self.MAX_CONCURRENT_UPDATES)
+
+        async def add_seen_device(device):
+            async with update_slots:
+                await self.add_device(device)
+            seen_macs.add(device.mac)
+
+        async def on_discovered(device):
+            logger.info("Discovered device: {}".format(repr(device)))
+            additions.append(asyncio.ensure_future(add_seen_device(device)))
+
+        await kasa.Discover.discover(on_discovered=on_discovered)
+        for result in await asyncio.gather(*additions, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(result)
+
+        # forget the devices that did not show up this time
+        await self.clear_devices(keep=seen_macs)
+
         self.refresh_button.state(["!disabled"])
         self.refresh_button["text"] = "Refresh"
 
-    async def clear_devices(self):
-        async with self.device_lock:
-            for mac, widget in self.device_widgets.items():
+    async def clear_devices(self, keep=frozenset()):
+        """Remove all devices (and their widgets) except for the mac addresses
+        in keep
+        """
+        for mac in self._known_macs - keep:
+            widget = self.device_widgets.pop(mac, None)
+            if widget is not None:
                 widget.destroy()
-            self.device_widgets.clear()
-            self.kasa_devices.clear()
+        self._known_macs &= keep
 
     def start_refresh(self):
-        """Returns a *concurrent* future, rather than an *asyncio* future. You
-        can block on the result from a *synchronous* thread using
-        self.start_refresh().result().
+        """Schedule a refresh on the asyncio event loop. Exceptions will go to
+        the asyncio exception handler.
 
-        :rtype: concurrent.futures.Future
+        :rtype: asyncio.Task
         """
         logger.info("KasaDevices.start_refresh() called")
-
-        async def call_later(coro, *args, **kwargs):
-            # call later isn't particularly necessary, but by using it, out
-            # exceptions will go to the asyncio exceptions handler
-            self.event_loop.create_task(coro(*args, **kwargs))
-
-        return asyncio.run_coroutine_threadsafe(
-            call_later(self._do_refresh), self.event_loop
-        )
+        return self.event_loop.create_task(self._do_refresh())
 
 
 def run():
@@ -504,6 +745,8 @@ def run():
     root = tkinter.Tk()
     root.title("Kasa Devices")
     root.geometry("500x400")
+    # ttk sends this to every widget, but only the first one has work to do
+    root.bind("<<ThemeChanged>>", _clear_style_caches)
     try:
         root.iconbitmap(resource_path("extra/icon.ico"))
     except Exception as e:
@@ -519,21 +762,14 @@ def run():
         logger.info("Caught KeyboardInterrupt. Shutting down.")
     finally:
         logger.info("Tkinter mainloop has exited.")
-        # stop the event loop
-        device_frame.event_loop.call_soon_threadsafe(device_frame.event_loop.stop)
-        device_frame.event_loop.call_soon_threadsafe(device_frame.event_loop.close)
-
+        # cancel whatever is still pending and close the event loop
+        loop = device_frame.event_loop
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
         logger.info("Stopped asyncio event loop")
-        # wait up to three seconds
-        device_frame.event_thread.join(3)
-        if device_frame.event_thread.is_alive():
-            # If we get here, then it is likely that there is an uncooperative
-            # asyncio task that is hogging the CPU and not surrending control
-            # via await.
-            logger.warning("Failed to stop event thread.")
-            # Since asyncio is not behaving, we need the operating system to
-            # end this process
-            apoptosis()
 
 
 def main():